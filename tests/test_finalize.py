@@ -0,0 +1,164 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from zoe_converter import (
+    SHARD_BUCKETS,
+    compute_shard_bounds,
+    finalize_partials,
+    get_shard_history,
+    verify_zoe_file,
+    write_partial_file,
+)
+
+SHARD_TOTAL = 4
+
+
+def apwx_args(tmp_path, run_id: str, shard_range: str = None):
+    return SimpleNamespace(
+        args=SimpleNamespace(
+            RUN_ID=run_id,
+            SHARD_RANGE=shard_range,
+            SHARD_TOTAL=str(SHARD_TOTAL),
+            MAX_THREADS="2",
+            TEST_YN="N",
+            SHARD_HISTORY_FILE=None,
+            OUTPUT_FILE_PATH=str(tmp_path),
+            OUTPUT_FILE_NAME="ZOE.FTF",
+        )
+    )
+
+
+def build_record(persnbr: int) -> str:
+    """Extracted record: 56 data fields plus the trailing account status"""
+    fields = ["x"] * 57
+    fields[1] = str(persnbr)
+    fields[3] = str(5000 + persnbr)
+    fields[56] = "ACT"
+    return "|".join(fields)
+
+
+def write_partial(
+    tmp_path, run_id: str, shard_lo: int, shard_hi: int, errors: int = 0, rows=10
+):
+    bounds = compute_shard_bounds(None, SHARD_TOTAL, SHARD_BUCKETS)
+    shard_report = {
+        shard_id: {
+            "rows": rows,
+            "detailRows": rows,
+            "seconds": 1.0,
+            "errors": errors,
+            "bucketLo": bounds[shard_id][0],
+            "bucketHi": bounds[shard_id][1],
+        }
+        for shard_id in range(shard_lo, shard_hi + 1)
+    }
+    first = 1000 * (shard_lo + 1)
+    records = [build_record(first + i) for i in range(rows)]
+    apwx = apwx_args(tmp_path, run_id, f"{shard_lo}-{shard_hi}")
+    write_partial_file(records, str(tmp_path / "ZOE.FTF"), apwx, shard_report)
+
+
+def finalize(tmp_path, run_id: str):
+    finalize_partials(apwx_args(tmp_path, run_id), str(tmp_path / "ZOE.FTF"))
+
+
+def partial_files(tmp_path) -> list:
+    return sorted(name for name in os.listdir(tmp_path) if ".part" in name)
+
+
+def test_finalize_merges_and_removes_partials(tmp_path):
+    write_partial(tmp_path, "r1", 2, 3)
+    write_partial(tmp_path, "r1", 0, 1)
+
+    finalize(tmp_path, "r1")
+
+    output = str(tmp_path / "ZOE.FTF")
+    assert verify_zoe_file(output) == []
+    details = open(output).read().splitlines()[2:-1]
+    assert [line.split("|")[4] for line in details] == [str(i) for i in range(1, 21)]
+    # Shard order, not file order
+    assert details[0].split("|")[6] == "1000"
+    assert partial_files(tmp_path) == []
+    assert len(get_shard_history(str(tmp_path / "ZOE.FTF.shards.yaml"))["shards"]) == 4
+
+
+def test_finalize_ignores_other_runs(tmp_path):
+    # Last run's 2-3 partial was never merged; this run uses a single host
+    write_partial(tmp_path, "r1", 2, 3)
+    write_partial(tmp_path, "r2", 0, 3)
+
+    finalize(tmp_path, "r2")
+
+    assert verify_zoe_file(str(tmp_path / "ZOE.FTF")) == []
+    assert partial_files(tmp_path) == [
+        "ZOE.FTF.part0002-0003",
+        "ZOE.FTF.part0002-0003.meta.yaml",
+    ]
+
+
+def test_finalize_rejects_missing_shards(tmp_path):
+    write_partial(tmp_path, "r1", 2, 3)
+    write_partial(tmp_path, "r2", 0, 1)
+
+    with pytest.raises(ValueError, match=r"for shards \[2, 3\]"):
+        finalize(tmp_path, "r2")
+
+
+def test_finalize_rejects_overlapping_shards(tmp_path):
+    write_partial(tmp_path, "r1", 0, 2)
+    write_partial(tmp_path, "r1", 2, 3)
+
+    with pytest.raises(ValueError, match="more than one partial"):
+        finalize(tmp_path, "r1")
+
+
+def test_finalize_rejects_errored_shards(tmp_path):
+    # A host that lost its DNA connection: no records, consistent metadata
+    write_partial(tmp_path, "r1", 0, 1)
+    write_partial(tmp_path, "r1", 2, 3, errors=6, rows=0)
+
+    with pytest.raises(ValueError, match=r"shards \[2, 3\] had failed queries"):
+        finalize(tmp_path, "r1")
+    assert not os.path.exists(tmp_path / "ZOE.FTF.shards.yaml")
+    assert len(partial_files(tmp_path)) == 4
+
+
+def test_finalize_rejects_part_not_matching_metadata(tmp_path):
+    write_partial(tmp_path, "r1", 0, 3)
+    with open(tmp_path / "ZOE.FTF.part0000-0003", "ab") as f:
+        f.write(build_record(99).rpartition("|")[0].encode() + b"\n")
+
+    with pytest.raises(ValueError, match="metadata says"):
+        finalize(tmp_path, "r1")
+
+
+def test_finalize_requires_partials_for_run(tmp_path):
+    with pytest.raises(ValueError, match="No partial outputs"):
+        finalize(tmp_path, "r1")
+
+
+def test_rewriting_partial_removes_old_metadata_first(tmp_path, monkeypatch):
+    write_partial(tmp_path, "r1", 0, 3)
+
+    def fail_write(self, line):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("zoe_converter.ZoeFileWriter.write", fail_write)
+    with pytest.raises(OSError):
+        write_partial(tmp_path, "r2", 0, 3)
+    assert not os.path.exists(tmp_path / "ZOE.FTF.part0000-0003.meta.yaml")
+
+
+def test_finalize_keeps_carriage_returns_inside_fields(tmp_path):
+    write_partial(tmp_path, "r1", 0, 3, rows=3)
+    part_path = tmp_path / "ZOE.FTF.part0000-0003"
+    part_path.write_bytes(part_path.read_bytes().replace(b"|x|", b"|x\r|", 1))
+
+    finalize(tmp_path, "r1")
+
+    output = str(tmp_path / "ZOE.FTF")
+    assert verify_zoe_file(output) == []
+    with open(output, "rb") as f:
+        assert f.read().count(b"\r") == 1
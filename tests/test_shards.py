@@ -0,0 +1,160 @@
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+from zoe_converter import (
+    SHARD_BUCKETS,
+    compute_shard_bounds,
+    get_shard_history,
+    get_shard_range,
+    save_shard_history,
+)
+
+
+def bucket_widths(bounds: list) -> list:
+    return [hi - lo + 1 for lo, hi in bounds]
+
+
+def assert_tiles(bounds: list, buckets: int = SHARD_BUCKETS):
+    """Every bucket is covered exactly once, in order"""
+    assert bounds[0][0] == 0
+    assert bounds[-1][1] == buckets - 1
+    for (_, prev_hi), (lo, hi) in zip(bounds, bounds[1:]):
+        assert lo == prev_hi + 1
+        assert lo <= hi
+
+
+def history(*shards, key: str = "seconds") -> dict:
+    return {
+        "shardBuckets": SHARD_BUCKETS,
+        "shards": [
+            {"bucketLo": lo, "bucketHi": hi, key: cost} for lo, hi, cost in shards
+        ],
+    }
+
+
+def test_no_history_gives_equal_shards():
+    bounds = compute_shard_bounds(None, 4, SHARD_BUCKETS)
+    assert bounds == [(0, 255), (256, 511), (512, 767), (768, 1023)]
+
+
+@pytest.mark.parametrize("shards", [1, 3, 7, 8, 1024])
+def test_bounds_always_tile_every_bucket(shards):
+    bounds = compute_shard_bounds(None, shards, SHARD_BUCKETS)
+    assert len(bounds) == shards
+    assert_tiles(bounds)
+
+
+def test_equal_history_keeps_equal_shards():
+    hist = history((0, 511, 100.0), (512, 1023, 100.0))
+    bounds = compute_shard_bounds(hist, 4, SHARD_BUCKETS)
+    assert bucket_widths(bounds) == [256, 256, 256, 256]
+
+
+def test_skewed_history_moves_buckets_to_cheap_shards():
+    # First half three times as expensive as the second
+    hist = history((0, 511, 300.0), (512, 1023, 100.0))
+    bounds = compute_shard_bounds(hist, 4, SHARD_BUCKETS)
+    assert_tiles(bounds)
+    assert bounds[-1] == (513, 1023)
+    assert all(170 <= width <= 171 for width in bucket_widths(bounds)[:3])
+
+
+def test_one_expensive_bucket_gets_its_own_shard():
+    hist = history((0, 0, 100000.0), (1, 1023, 1.0))
+    bounds = compute_shard_bounds(hist, 8, SHARD_BUCKETS)
+    assert_tiles(bounds)
+    assert bounds[0] == (0, 0)
+    # The cheap buckets are spread evenly over the other seven shards
+    widths = bucket_widths(bounds)[1:]
+    assert max(widths) - min(widths) <= 1
+
+
+def test_rows_are_used_when_any_shard_lacks_seconds():
+    hist = history((0, 511, 300), (512, 1023, 100), key="rows")
+    hist["shards"][0]["seconds"] = 5.0
+    bounds = compute_shard_bounds(hist, 4, SHARD_BUCKETS)
+    assert bounds[-1] == (513, 1023)
+
+
+def test_history_for_other_bucket_count_is_ignored():
+    hist = history((0, 0, 100000.0), (1, 1023, 1.0))
+    hist["shardBuckets"] = 512
+    assert compute_shard_bounds(hist, 4, SHARD_BUCKETS) == compute_shard_bounds(
+        None, 4, SHARD_BUCKETS
+    )
+
+
+def shard_stats(seconds: list, errors: list = None) -> dict:
+    errors = errors or [0] * len(seconds)
+    return {
+        i: {"rows": 10, "detailRows": 10, "seconds": s, "errors": e}
+        for i, (s, e) in enumerate(zip(seconds, errors))
+    }
+
+
+def test_save_shard_history_round_trip(tmp_path):
+    path = str(tmp_path / "shards.yaml")
+    bounds = compute_shard_bounds(None, 2, SHARD_BUCKETS)
+    save_shard_history(path, bounds, shard_stats([1.5, 2.5]))
+
+    saved = get_shard_history(path)
+    assert saved["shardBuckets"] == SHARD_BUCKETS
+    assert [(s["bucketLo"], s["bucketHi"]) for s in saved["shards"]] == bounds
+    assert [s["seconds"] for s in saved["shards"]] == [1.5, 2.5]
+
+
+@pytest.mark.parametrize(
+    "stats",
+    [
+        # A shard that never reported
+        {0: {"detailRows": 10, "seconds": 3000.0, "errors": 0}},
+        # A shard whose queries all failed fast
+        shard_stats([0.05, 3000.0], errors=[6, 0]),
+    ],
+)
+def test_save_shard_history_skips_failed_runs(tmp_path, stats):
+    path = tmp_path / "shards.yaml"
+    previous = history((0, 511, 1.0), (512, 1023, 1.0))
+    path.write_text(yaml.safe_dump(previous))
+
+    bounds = compute_shard_bounds(None, 2, SHARD_BUCKETS)
+    save_shard_history(str(path), bounds, stats)
+    assert yaml.safe_load(path.read_text()) == previous
+
+
+def apwx_args(**args) -> SimpleNamespace:
+    defaults = {"MAX_THREADS": "4", "SHARD_RANGE": None, "SHARD_TOTAL": None}
+    return SimpleNamespace(args=SimpleNamespace(**dict(defaults, **args)))
+
+
+def test_shard_range_defaults_to_all_threads():
+    assert get_shard_range(apwx_args()) == (4, 0, 3)
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        ({"SHARD_RANGE": "2-3", "SHARD_TOTAL": "8"}, (8, 2, 3)),
+        ({"SHARD_RANGE": "5", "SHARD_TOTAL": "8"}, (8, 5, 5)),
+    ],
+)
+def test_shard_range_parses_host_range(args, expected):
+    assert get_shard_range(apwx_args(**args)) == expected
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        {"MAX_THREADS": str(SHARD_BUCKETS + 1)},
+        {"MAX_THREADS": "0"},
+        {"SHARD_RANGE": "0-1", "SHARD_TOTAL": str(SHARD_BUCKETS + 1)},
+        {"SHARD_RANGE": "0-1"},
+        {"SHARD_RANGE": "6-8", "SHARD_TOTAL": "8"},
+        {"SHARD_RANGE": "3-2", "SHARD_TOTAL": "8"},
+    ],
+)
+def test_shard_range_rejects_invalid_values(args):
+    with pytest.raises(ValueError):
+        get_shard_range(apwx_args(**args))
@@ -0,0 +1,94 @@
+import pytest
+
+import zoe_converter
+from zoe_converter import (
+    build_cde_record,
+    build_header_record,
+    build_trailer_record,
+    verify_zoe_file,
+)
+
+
+def build_detail(seq_nbr: int, acctnbr: int, action: str = "A") -> str:
+    """Detail line with the same column count as the CDE record"""
+    fields = ["x"] * 56
+    fields[1] = str(1000 + seq_nbr)
+    fields[3] = str(acctnbr)
+    return "|".join(["6", action, "01", "FTF", str(seq_nbr)] + fields)
+
+
+def write_zoe_file(path, details: list, acct_hash: int, added: int = None):
+    with open(path, "w", newline="\n") as f:
+        f.write(build_cde_record() + "\n")
+        f.write(build_header_record({"test": "N", "fileType": "LOAD"}) + "\n")
+        for line in details:
+            f.write(line + "\n")
+        trailer = {
+            "recordCt": len(details) + 2,
+            "added": len(details) if added is None else added,
+            "acctHash": acct_hash,
+            "test": "N",
+            "fileType": "LOAD",
+        }
+        f.write(build_trailer_record(trailer) + "\n")
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Force several chunks so chunk boundaries are exercised
+    monkeypatch.setattr(zoe_converter, "VERIFY_CHUNK_BYTES", 4096)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_valid_file_verifies(tmp_path, small_chunks, workers):
+    details = [build_detail(i + 1, 5000 + i) for i in range(500)]
+    path = tmp_path / "load.FTF"
+    write_zoe_file(path, details, sum(5000 + i for i in range(500)))
+
+    assert verify_zoe_file(str(path), workers) == []
+
+
+def test_trailer_mismatch_is_reported(tmp_path):
+    details = [build_detail(i + 1, 5000 + i) for i in range(10)]
+    path = tmp_path / "load.FTF"
+    write_zoe_file(path, details, 1, added=9)
+
+    errors = verify_zoe_file(str(path))
+    assert any("CDE0111" in e for e in errors)
+    assert any("CDE0110" in e for e in errors)
+
+
+@pytest.mark.parametrize(
+    "bad_line, label",
+    [
+        ("garbage line", "are not detail records"),
+        ("", "blank lines"),
+        ("\r", "blank lines"),
+        (build_detail(5, 5004, action="X"), "action other than A, C or D"),
+        (build_detail(5, 5004) + "|extra", "columns"),
+    ],
+)
+def test_bad_lines_are_reported_with_offset(tmp_path, bad_line, label):
+    details = [build_detail(i + 1, 5000 + i) for i in range(4)]
+    path = tmp_path / "load.FTF"
+    good_path = tmp_path / "good.FTF"
+    write_zoe_file(good_path, details, sum(5000 + i for i in range(4)))
+    insert_at = good_path.read_bytes().index(details[2].encode())
+
+    is_detail = bad_line.startswith("6|")
+    details.insert(2, bad_line)
+    write_zoe_file(
+        path,
+        details,
+        sum(5000 + i for i in range(4)) + (5004 if is_detail else 0),
+        added=sum(1 for line in details if line.startswith("6|A|")),
+    )
+    if not is_detail:
+        # Trailer counts match the real details; only the bad line is wrong
+        text = path.read_text()
+        path.write_text(text.replace("CDE0133:7", "CDE0133:6"))
+
+    errors = verify_zoe_file(str(path))
+    assert len(errors) == 1, errors
+    assert label in errors[0]
+    assert f"byte offset {insert_at}" in errors[0]
@@ -1,3 +1,4 @@
+import sys
 import time
 import threading
 import datetime
@@ -6,20 +7,38 @@ import os
 from dataclasses import dataclass
 from enum import StrEnum, auto
 from typing import Any, Optional, List, Dict
+from collections import Counter
 from pathlib import Path
 from ftfcu_appworx import Apwx, JobTime
 from oracledb import Connection as DbConnection
-from datetime import datetime, timezone
-from multiprocessing import Manager
+from datetime import datetime, timezone, timedelta
+from multiprocessing import Manager, Pool
 import pytz
 import pyodbc
 import re
 import stat
+import mmap
+import hashlib
+import json
+import cProfile
+import pstats
+import tracemalloc
 
 version = 1.00
 
 TITLE_FORMAT = "{:>90}"
 LINE_FORMAT = "{:<20}"
+VERIFY_CHUNK_BYTES = 64 * 1024 * 1024
+SHARD_BUCKETS = 1024
+CHANGED_KEY_BATCH = 32767  # SYS.ODCINUMBERLIST capacity
+P2P_STAGE_BATCH = 5000
+PROFILE_TOP_N = 25
+ORG_QUERY_KEYS = ("cardOwnPersOrg", "org")
+P2P_OVERRIDE_COLS = ("CXCCustomerID", "registeredEmail", "registeredPhone")
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024
+WRITE_BATCH_RECORDS = 10000
+TAB_TABLE = str.maketrans("\t", " ")
+TAB_RUN_RE = re.compile(r"\t+")
 
 
 class AppWorxEnum(StrEnum):
@@ -36,6 +55,15 @@ class AppWorxEnum(StrEnum):
     RPT_ONLY = auto()
     OLD_ZOE_FILE = auto()
     NEW_ZOE_FILE = auto()
+    VERIFY_ZOE_FILE = auto()
+    UPDT_FILE_NAME = auto()
+    SHARD_HISTORY_FILE = auto()
+    DELTA_STATE_FILE = auto()
+    P2P_STAGE_YN = auto()
+    SQL_FORMAT_YN = auto()
+    SHARD_TOTAL = auto()
+    SHARD_RANGE = auto()
+    RUN_ID = auto()
 
     def __str__(self):
         return self.name
@@ -46,25 +74,116 @@ class ScriptData:
     apwx: Apwx
     dbh: DbConnection
     config: Any
+    profile_dir: Optional[str] = None
+
+
+class ZoeFileWriter:
+    """Buffered binary ZOE file writer that encodes lines once per batch"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = []
+        self.f = open(path, "wb", buffering=WRITE_BUFFER_BYTES)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def write(self, line: str):
+        self.lines.append(line)
+        if len(self.lines) >= WRITE_BATCH_RECORDS:
+            self.flush_batch()
+
+    def flush_batch(self):
+        if self.lines:
+            self.lines.append("")  # trailing newline on the last line
+            self.f.write("\n".join(self.lines).encode("utf-8"))
+            self.lines = []
+
+    def close(self):
+        self.flush_batch()
+        self.f.flush()
+        if hasattr(os, "posix_fadvise"):
+            # The file is read back by the transfer job, not by this process.
+            # Only a hint: pages still being written back stay cached
+            os.posix_fadvise(self.f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
 
 
 def run(apwx: Apwx, current_time: float) -> bool:
     """Main execution function"""
     print("run started")
-    script_data = initialize(apwx)
-    # print("apwx: ", apwx)
-    # print("Script_data: ", script_data)
     mode = apwx.args.MODE
 
-    if mode not in ("NEW", "DELTA"):
-        raise ValueError("Invalid MODE. Must be 'NEW' or 'DELTA'.")
+    if mode not in (
+        "NEW",
+        "DELTA",
+        "NEW_DELTA",
+        "INCR",
+        "VERIFY",
+        "FORMAT_CHECK",
+        "FINALIZE",
+    ):
+        raise ValueError(
+            "Invalid MODE. Must be 'NEW', 'DELTA', 'NEW_DELTA', 'INCR', 'VERIFY', "
+            "'FORMAT_CHECK' or 'FINALIZE'."
+        )
+    if apwx.args.SHARD_RANGE and mode != "NEW":
+        raise ValueError("SHARD_RANGE is only supported in NEW mode")
+    if (apwx.args.SHARD_RANGE or mode == "FINALIZE") and not apwx.args.RUN_ID:
+        raise ValueError("SHARD_RANGE and FINALIZE require RUN_ID")
+    if mode == "NEW_DELTA" and (
+        not apwx.args.OLD_ZOE_FILE or not apwx.args.UPDT_FILE_NAME
+    ):
+        raise ValueError("NEW_DELTA mode requires OLD_ZOE_FILE and UPDT_FILE_NAME")
+    if mode == "INCR" and not (
+        os.path.exists(get_delta_state_path(apwx))
+        or (apwx.args.OLD_ZOE_FILE and os.path.exists(apwx.args.OLD_ZOE_FILE))
+    ):
+        raise ValueError("INCR mode requires DELTA_STATE_FILE or OLD_ZOE_FILE")
+    if mode in ("NEW", "NEW_DELTA", "INCR"):
+        get_shard_range(apwx)  # Validates MAX_THREADS/SHARD_RANGE before connecting
     print(f"ZOE file mode is {mode}")
 
     fh_zoe_path = os.path.join(apwx.args.OUTPUT_FILE_PATH, apwx.args.OUTPUT_FILE_NAME)
 
-    with open(fh_zoe_path, "w", encoding="utf-8") as f:
-        timestamp = time.ctime(current_time)
-        f.write(build_cde_record() + "\n")
+    if mode == "VERIFY":
+        # Verification only reads an existing file, so no DB connection is
+        # opened and the output file is left untouched
+        verify_path = apwx.args.VERIFY_ZOE_FILE or fh_zoe_path
+        errors = verify_zoe_file(verify_path, int(apwx.args.MAX_THREADS))
+        if errors:
+            for error in errors:
+                print(f"VERIFY: {error}")
+            raise ValueError(f"ZOE file verification failed: {verify_path}")
+        print(f"ZOE file verified: {verify_path}")
+        return True
+
+    if mode == "FINALIZE":
+        # Merges the partial outputs of every host; no DB connection needed
+        finalize_partials(apwx, fh_zoe_path)
+        return True
+
+    script_data = initialize(apwx)
+    # print("apwx: ", apwx)
+    # print("Script_data: ", script_data)
+
+    if mode == "FORMAT_CHECK":
+        # Compares SQL and Python formatting of one shard; no file is written
+        if not check_format_parity(apwx, script_data):
+            raise ValueError("SQL record format check failed")
+        print("SQL record formatting matches build_detail_record")
+        return True
+
+    # Partial runs must not touch the shared final file
+    if not apwx.args.SHARD_RANGE:
+        with open(fh_zoe_path, "w", encoding="utf-8") as f:
+            timestamp = time.ctime(current_time)
+            f.write(build_cde_record() + "\n")
 
     seq_nbr = 0
     added = 0
@@ -79,74 +198,41 @@ def run(apwx: Apwx, current_time: float) -> bool:
         except FileNotFoundError:
             print(f"File not found: {fh_zoe_path}")
             file_stat = None
-        threads_list = []
-        manager = Manager()
-        zoe_data = manager.list()  # Shared list among threads
-        max_threads = int(apwx.args.MAX_THREADS)
-        connection_num = 0
-
-        print("Fetching ZOE records from DNA")
-
-        for thread_id in range(max_threads):
-            apwx_t = apwx  # clone if needed; here it's just passed
-            connection_num += 1
-            thread = threading.Thread(
-                target=thread_sub,
-                args=(
-                    connection_num,
-                    script_data,
-                    apwx_t,
-                    thread_id,
-                    max_threads,
-                    zoe_data,
-                    apwx,
-                ),
-            )
-            threads_list.append(thread)
-            thread.start()
 
-        for thread in threads_list:
-            thread.join()
+        if apwx.args.SHARD_RANGE:
+            # This host extracts a subset of shards; FINALIZE writes the file
+            shard_report = {}
+            zoe_data = extract_zoe_records(apwx, script_data, None, shard_report)
+            print(f"Found {len(zoe_data)} ZOE records")
+            write_partial_file(zoe_data, fh_zoe_path, apwx, shard_report)
+            return True
+
+        zoe_data = extract_zoe_records(apwx, script_data)
 
         print(f"Found {len(zoe_data)} ZOE records")
 
         # Reopen file and write header and records
-        with open(fh_zoe_path, "w", encoding="utf-8") as f:
-            f.write(build_cde_record() + "\n")
+        with ZoeFileWriter(fh_zoe_path) as f:
+            f.write(build_cde_record())
 
             header_rec = build_header_record(
                 {"test": apwx.args.TEST_YN, "fileType": "LOAD"}
             )
-            f.write(header_rec + "\n")
+            f.write(header_rec)
 
             print("Printing ZOE file")
+            env = "03" if apwx.args.TEST_YN == "Y" else "01"
 
             for record in zoe_data:
-                record = str(record).strip()
-                record = re.sub(r"\t+", " ", record)  # Replace tabs with spaces
-
-                line_ary = record.split("|")
-                if len(line_ary) > 3:
-                    acct_hash += int(line_ary[3]) if line_ary[3].isdigit() else 0
-
-                # Remove the last element (account status) from line_ary
-                acct_stat = line_ary.pop() if line_ary else ""
-
-                detail_first5 = "|".join(
-                    [
-                        "6",
-                        "A",
-                        "03" if apwx.args.TEST_YN == "Y" else "01",
-                        "FTF",
-                        str(seq_nbr + 1),
-                    ]
-                )
+                record_data = split_zoe_record(record)[1]
+
+                line_ary = record_data.split("|", 4)
+                if len(line_ary) > 3 and line_ary[3].isdigit():
+                    acct_hash += int(line_ary[3])
+
                 seq_nbr += 1
                 added += 1
-
-                # Join first 56 elements (0-55) of line_ary
-                line = "|".join([detail_first5] + line_ary[:56])
-                f.write(line + "\n")
+                f.write(f"6|A|{env}|FTF|{seq_nbr}|{record_data}")
 
             trailer_rec = build_trailer_record(
                 {
@@ -161,7 +247,73 @@ def run(apwx: Apwx, current_time: float) -> bool:
                 file_stat,
             )
 
-            f.write(trailer_rec + "\n")
+            f.write(trailer_rec)
+
+        profile_snapshot(script_data.profile_dir, "after_write")
+
+    elif mode == "NEW_DELTA":
+        # One extraction feeds both the LOAD file and the UPDT file
+        fh_updt_path = os.path.join(
+            apwx.args.OUTPUT_FILE_PATH, apwx.args.UPDT_FILE_NAME
+        )
+
+        digest_zoe_old = get_zoe_file_digests(apwx.args.OLD_ZOE_FILE)
+        profile_snapshot(script_data.profile_dir, "after_delta_hash")
+        zoe_data = extract_zoe_records(apwx, script_data)
+
+        print(f"Found {len(zoe_data)} ZOE records")
+        write_load_and_updt(
+            zoe_data, fh_zoe_path, fh_updt_path, digest_zoe_old, apwx.args.TEST_YN
+        )
+        profile_snapshot(script_data.profile_dir, "after_write")
+
+    elif mode == "INCR":
+        # Only keys changed since the last successful run are extracted and
+        # diffed against the saved key/digest state
+        state_path = get_delta_state_path(apwx)
+        state = get_delta_state(state_path, apwx.args.OLD_ZOE_FILE)
+        profile_snapshot(script_data.profile_dir, "after_delta_hash")
+
+        # Taken before extraction so changes made during the run are picked
+        # up again next time
+        new_watermark = get_db_sysdate(script_data.dbh)
+        changed_keys = get_changed_keys(script_data, state["watermark"])
+
+        # P2P tables carry no change dates, so their override values are
+        # diffed against the digests saved by the previous run
+        p2p_digests = get_p2p_digests(apwx, script_data.config)
+        p2p_changed = {
+            int(key)
+            for key in p2p_digests.keys() | state["p2p"].keys()
+            if p2p_digests.get(key) != state["p2p"].get(key)
+        }
+        print(f"Found {len(p2p_changed)} changed P2P customers")
+        changed_keys["pers"] = sorted(set(changed_keys["pers"]) | p2p_changed)
+
+        zoe_data = extract_zoe_records(apwx, script_data, changed_keys)
+
+        print(f"Found {len(zoe_data)} ZOE records for changed keys")
+        updt_new = {}
+        for record in zoe_data:
+            key, record_data = split_zoe_record(record)
+            updt_new[key] = record_data
+
+        with ZoeFileWriter(fh_zoe_path) as f:
+            f.write(build_cde_record())
+            f.write(
+                build_header_record({"test": apwx.args.TEST_YN, "fileType": "UPDT"})
+            )
+            file_stat = os.stat(fh_zoe_path)
+            write_updt_records(
+                f, updt_new, state["digests"], apwx.args.TEST_YN, file_stat
+            )
+        profile_snapshot(script_data.profile_dir, "after_write")
+
+        for key, record_data in updt_new.items():
+            state["digests"][key] = get_record_digest(record_data)
+        state["watermark"] = new_watermark
+        state["p2p"] = p2p_digests
+        save_delta_state(state_path, state)
 
     elif mode == "DELTA":  # Delta mode implementation
         print("Processing DELTA mode")
@@ -182,6 +334,7 @@ def run(apwx: Apwx, current_time: float) -> bool:
             # Load old and new ZOE file data
             hash_zoe_old = get_zoe_file_hash(apwx.args.OLD_ZOE_FILE)[0]
             hash_zoe_new, acct_hash = get_zoe_file_hash(apwx.args.NEW_ZOE_FILE)
+            profile_snapshot(script_data.profile_dir, "after_delta_hash")
     
             print("Comparing New to Old")
             rec_ct = 0
@@ -247,9 +400,387 @@ def run(apwx: Apwx, current_time: float) -> bool:
     
             f.write(trailer_rec + "\n")
     
+        profile_snapshot(script_data.profile_dir, "after_write")
         return True
 
 
+def extract_zoe_records(
+    apwx: Apwx,
+    script_data,
+    changed_keys: Optional[Dict] = None,
+    shard_report: Optional[Dict] = None,
+) -> list:
+    """Run the DNA extraction threads and return the shared record list"""
+    threads_list = []
+    manager = Manager()
+    zoe_data = manager.list()  # Shared list among threads
+    max_threads, shard_lo, shard_hi = get_shard_range(apwx)
+    connection_num = 0
+
+    history_path = get_shard_history_path(apwx)
+    shard_bounds = compute_shard_bounds(
+        get_shard_history(history_path), max_threads, SHARD_BUCKETS
+    )
+    shard_stats = {}
+
+    if apwx.args.P2P_STAGE_YN == "Y":
+        check_p2p_stage(script_data.dbh)
+
+    print("Fetching ZOE records from DNA")
+
+    for thread_id in range(shard_lo, shard_hi + 1):
+        apwx_t = apwx  # clone if needed; here it's just passed
+        connection_num += 1
+        thread = threading.Thread(
+            target=thread_sub,
+            args=(
+                connection_num,
+                script_data,
+                apwx_t,
+                thread_id,
+                max_threads,
+                zoe_data,
+                apwx,
+                shard_bounds[thread_id],
+                shard_stats,
+                changed_keys,
+            ),
+        )
+        threads_list.append(thread)
+        thread.start()
+
+    for thread in threads_list:
+        thread.join()
+
+    if shard_report is not None:
+        # Partial runs hand their stats to FINALIZE instead of the history
+        for thread_id in range(shard_lo, shard_hi + 1):
+            shard_report[thread_id] = dict(
+                shard_stats.get(thread_id, {}),
+                bucketLo=shard_bounds[thread_id][0],
+                bucketHi=shard_bounds[thread_id][1],
+            )
+    elif changed_keys is None:
+        # Timings of a changed-keys run say nothing about full run shard sizes
+        save_shard_history(history_path, shard_bounds, shard_stats)
+
+    profile_snapshot(script_data.profile_dir, "after_extract")
+    return zoe_data
+
+
+def get_shard_range(apwx: Apwx) -> tuple:
+    """Return total shard count and the first and last shard this host runs"""
+    # Each shard needs at least one ORA_HASH bucket
+    if not apwx.args.SHARD_RANGE:
+        max_threads = int(apwx.args.MAX_THREADS)
+        if not 1 <= max_threads <= SHARD_BUCKETS:
+            raise ValueError(f"MAX_THREADS must be between 1 and {SHARD_BUCKETS}")
+        return max_threads, 0, max_threads - 1
+
+    if not apwx.args.SHARD_TOTAL:
+        raise ValueError("SHARD_RANGE requires SHARD_TOTAL")
+    shard_total = int(apwx.args.SHARD_TOTAL)
+    if not 1 <= shard_total <= SHARD_BUCKETS:
+        raise ValueError(f"SHARD_TOTAL must be between 1 and {SHARD_BUCKETS}")
+    shard_lo, _, shard_hi = apwx.args.SHARD_RANGE.partition("-")
+    shard_lo = int(shard_lo)
+    shard_hi = int(shard_hi) if shard_hi else shard_lo
+    if not 0 <= shard_lo <= shard_hi < shard_total:
+        raise ValueError(
+            f"SHARD_RANGE {apwx.args.SHARD_RANGE} is outside 0-{shard_total - 1}"
+        )
+    return shard_total, shard_lo, shard_hi
+
+
+def get_shard_history_path(apwx: Apwx) -> str:
+    """Shard history file, defaults to <output>.shards.yaml"""
+    return apwx.args.SHARD_HISTORY_FILE or os.path.join(
+        apwx.args.OUTPUT_FILE_PATH, apwx.args.OUTPUT_FILE_NAME + ".shards.yaml"
+    )
+
+
+def write_partial_file(
+    zoe_data: list, fh_zoe_path: str, apwx: Apwx, shard_report: Dict
+):
+    """Write one host's records and count/hash metadata for FINALIZE"""
+    shard_total, shard_lo, shard_hi = get_shard_range(apwx)
+    part_path = f"{fh_zoe_path}.part{shard_lo:04d}-{shard_hi:04d}"
+    meta_path = part_path + ".meta.yaml"
+    record_ct = 0
+    acct_hash = 0
+
+    # An earlier run's metadata must not vouch for the part being rewritten
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # Records are written without the 5 metadata fields; FINALIZE numbers them
+    with ZoeFileWriter(part_path) as f:
+        for record in zoe_data:
+            record_data = split_zoe_record(record)[1]
+            line_ary = record_data.split("|", 4)
+            if len(line_ary) > 3 and line_ary[3].isdigit():
+                acct_hash += int(line_ary[3])
+            record_ct += 1
+            f.write(record_data)
+
+    meta = {
+        "runId": apwx.args.RUN_ID,
+        "shardTotal": shard_total,
+        "shardLo": shard_lo,
+        "shardHi": shard_hi,
+        "shardBuckets": SHARD_BUCKETS,
+        "recordCt": record_ct,
+        "acctHash": acct_hash,
+        "shards": {k: dict(v) for k, v in shard_report.items()},
+    }
+    # Metadata is written last so FINALIZE never picks up a half-written part
+    with open(meta_path, "w") as f:
+        yaml.safe_dump(meta, f)
+    print(f"Wrote {record_ct} records for shards {shard_lo}-{shard_hi} to {part_path}")
+
+
+def finalize_partials(apwx: Apwx, fh_zoe_path: str):
+    """Merge partial outputs into one LOAD file with a single header/trailer"""
+    run_id = apwx.args.RUN_ID
+    part_dir = os.path.dirname(fh_zoe_path) or "."
+    part_prefix = os.path.basename(fh_zoe_path) + ".part"
+    metas = []
+    for name in sorted(os.listdir(part_dir)):
+        if name.startswith(part_prefix) and name.endswith(".meta.yaml"):
+            with open(os.path.join(part_dir, name), "r") as f:
+                meta = yaml.safe_load(f)
+            # Leftovers from other runs are never merged
+            if str(meta.get("runId")) != run_id:
+                print(f"Ignoring partial {name} from run {meta.get('runId')}")
+                continue
+            meta["path"] = os.path.join(part_dir, name[: -len(".meta.yaml")])
+            metas.append(meta)
+    if not metas:
+        raise ValueError(f"No partial outputs found for {fh_zoe_path} run {run_id}")
+    metas.sort(key=lambda m: m["shardLo"])
+
+    # Every shard and every ORA_HASH bucket must be covered exactly once
+    shard_total = metas[0]["shardTotal"]
+    shards = {}
+    for meta in metas:
+        if meta["shardTotal"] != shard_total:
+            raise ValueError(f"Partial {meta['path']} has a different SHARD_TOTAL")
+        for shard_id, stats in meta["shards"].items():
+            if shard_id in shards:
+                raise ValueError(f"Shard {shard_id} appears in more than one partial")
+            shards[shard_id] = stats
+    if sorted(shards) != list(range(shard_total)):
+        missing = sorted(set(range(shard_total)) - set(shards))
+        raise ValueError(f"Missing partial outputs for shards {missing}")
+    # A host whose queries failed writes a short but self-consistent partial
+    errored = sorted(k for k, v in shards.items() if v.get("errors"))
+    if errored:
+        raise ValueError(f"Partial outputs for shards {errored} had failed queries")
+    bucket_bounds = [
+        (shards[i]["bucketLo"], shards[i]["bucketHi"]) for i in range(shard_total)
+    ]
+    expected_lo = 0
+    for bucket_lo, bucket_hi in bucket_bounds:
+        if bucket_lo != expected_lo:
+            raise ValueError(
+                "Partials used different shard boundaries; rerun with the same "
+                "shard history on every host"
+            )
+        expected_lo = bucket_hi + 1
+    if expected_lo != metas[0]["shardBuckets"]:
+        raise ValueError("Partial shard boundaries do not cover every bucket")
+
+    test_yn = apwx.args.TEST_YN
+    env = "03" if test_yn == "Y" else "01"
+    seq_nbr = 0
+    acct_hash = 0
+
+    with ZoeFileWriter(fh_zoe_path) as f:
+        f.write(build_cde_record())
+        f.write(build_header_record({"test": test_yn, "fileType": "LOAD"}))
+        file_stat = os.stat(fh_zoe_path)
+
+        for meta in metas:
+            part_ct = 0
+            part_hash = 0
+            # Parts are LF-terminated; a stray CR inside a field is data
+            with open(meta["path"], "r", encoding="utf-8", newline="\n") as part:
+                for record_data in part:
+                    record_data = record_data.rstrip("\n")
+                    line_ary = record_data.split("|", 4)
+                    if len(line_ary) > 3 and line_ary[3].isdigit():
+                        part_hash += int(line_ary[3])
+                    part_ct += 1
+                    seq_nbr += 1
+                    f.write(f"6|A|{env}|FTF|{seq_nbr}|{record_data}")
+
+            if part_ct != meta["recordCt"] or part_hash != meta["acctHash"]:
+                raise ValueError(
+                    f"Partial {meta['path']} has {part_ct} records/hash {part_hash}, "
+                    f"metadata says {meta['recordCt']}/{meta['acctHash']}"
+                )
+            acct_hash += part_hash
+
+        f.write(
+            build_trailer_record(
+                {
+                    "recordCt": seq_nbr + 2,  # +2 for header/trailer
+                    "added": seq_nbr,
+                    "test": test_yn,
+                    "fileType": "LOAD",
+                    "acctHash": acct_hash,
+                },
+                file_stat,
+            )
+        )
+
+    print(f"Merged {len(metas)} partials, {seq_nbr} records, into {fh_zoe_path}")
+    # Shards whose worker failed carry no timings or report errors, and are
+    # left out so the history is not updated from them
+    shard_stats = {
+        k: v for k, v in shards.items() if "seconds" in v and not v.get("errors")
+    }
+    save_shard_history(get_shard_history_path(apwx), bucket_bounds, shard_stats)
+
+    # Merged partials are removed so a later run can never pick them up;
+    # metadata goes first so an interrupted cleanup leaves nothing mergeable
+    for meta in metas:
+        os.remove(meta["path"] + ".meta.yaml")
+        os.remove(meta["path"])
+    print(f"Removed {len(metas)} merged partials for run {run_id}")
+
+
+def write_load_and_updt(
+    zoe_data: list,
+    load_path: str,
+    updt_path: str,
+    digest_zoe_old: Dict,
+    test_yn: str,
+) -> None:
+    """Write the LOAD and UPDT files from a single pass over the extract"""
+    env = "03" if test_yn == "Y" else "01"
+    load_seq = 0
+    load_hash = 0
+    updt_new = {}
+
+    with ZoeFileWriter(load_path) as f_load, ZoeFileWriter(updt_path) as f_updt:
+        f_load.write(build_cde_record())
+        f_load.write(build_header_record({"test": test_yn, "fileType": "LOAD"}))
+        f_updt.write(build_cde_record())
+        f_updt.write(build_header_record({"test": test_yn, "fileType": "UPDT"}))
+        load_stat = os.stat(load_path)
+        updt_stat = os.stat(updt_path)
+
+        print("Printing LOAD and UPDT files")
+
+        for record in zoe_data:
+            key, record_data = split_zoe_record(record)
+
+            line_ary = record_data.split("|", 4)
+            if len(line_ary) > 3 and line_ary[3].isdigit():
+                load_hash += int(line_ary[3])
+
+            load_seq += 1
+            f_load.write(f"6|A|{env}|FTF|{load_seq}|{record_data}")
+
+            # Keyed per person, account and card, so every account of a
+            # person is diffed separately
+            updt_new[key] = record_data
+
+        f_load.write(
+            build_trailer_record(
+                {
+                    "recordCt": load_seq + 2,  # +2 for header/trailer
+                    "added": load_seq,
+                    "test": test_yn,
+                    "fileType": "LOAD",
+                    "acctHash": load_hash,
+                },
+                load_stat,
+            )
+        )
+
+        updt_seq = write_updt_records(
+            f_updt, updt_new, digest_zoe_old, test_yn, updt_stat
+        )
+
+    print(f"LOAD records: {load_seq}, UPDT records: {updt_seq}")
+
+
+def split_zoe_record(record) -> tuple:
+    """Return the diff key and 56 data fields of an extracted record"""
+    record = str(record).strip()
+    if "\t" in record:
+        # Replace tabs with spaces; only runs of tabs need the regex
+        if "\t\t" in record:
+            record = TAB_RUN_RE.sub(" ", record)
+        else:
+            record = record.translate(TAB_TABLE)
+
+    # Remove the last element (account status)
+    record_data = record.rpartition("|")[0]
+    if record_data.count("|") > 55:
+        record_data = "|".join(record_data.split("|")[:56])
+
+    return get_record_key(record_data), record_data
+
+
+def get_record_key(record_data: str) -> str:
+    """Diff key of a record: persnbr|acctnbr|cardnbr, as ZOE.pm getKey builds it"""
+    parts = record_data.split("|", 4) + ["", "", "", ""]
+    cardnbr, persnbr, acctnbr = parts[0], parts[1], parts[3]
+    if cardnbr:
+        key = "|".join((persnbr, acctnbr, cardnbr))
+    else:
+        key = "|".join((persnbr, acctnbr))
+    return key.rstrip("|")
+
+
+def write_updt_records(
+    f, updt_new: Dict, digest_zoe_old: Dict, test_yn: str, file_stat=None
+) -> int:
+    """Write changed and added records plus trailer of an UPDT file"""
+    env = "03" if test_yn == "Y" else "01"
+
+    print("Comparing New to Old")
+    updt_seq = 0
+    added = 0
+    changed = 0
+    updt_hash = 0
+    for key, record_data in updt_new.items():
+        old_digest = digest_zoe_old.get(key)
+        if old_digest is None:
+            action = "A"
+            added += 1
+        elif old_digest != get_record_digest(record_data):
+            action = "C"
+            changed += 1
+        else:
+            continue
+
+        updt_seq += 1
+        line_ary = record_data.split("|", 4)
+        if len(line_ary) > 3 and line_ary[3].isdigit():
+            updt_hash += int(line_ary[3])
+        f.write(f"6|{action}|{env}|FTF|{updt_seq}|{record_data}")
+
+    f.write(
+        build_trailer_record(
+            {
+                "recordCt": updt_seq + 2,  # +2 for header/trailer
+                "added": added,
+                "changed": changed,
+                "deleted": 0,
+                "test": test_yn,
+                "fileType": "UPDT",
+                "acctHash": updt_hash,
+            },
+            file_stat,
+        )
+    )
+    return updt_seq
+
+
 def thread_sub(
     connection_num: int,
     script_data,
@@ -258,10 +789,14 @@ def thread_sub(
     max_threads: int,
     zoe_data: list,
     apwx_vars: Apwx,
+    shard_bounds: tuple = (0, SHARD_BUCKETS - 1),
+    shard_stats: dict = None,
+    changed_keys: Optional[Dict] = None,
 ):
     """Thread function to process ZOE records"""
     time.sleep(connection_num)  # Delay to stagger thread starts
     print(f"Started thread: {thread_id}")
+    profiler = start_profiling(script_data.profile_dir, worker=True)
 
     p2p_args = {
         "zoe": True,
@@ -285,7 +820,7 @@ def thread_sub(
     # print("dna_db_connect: ", dna_db_connect)
 
     # Process ZOE records
-    process_zoe_records(
+    stats = process_zoe_records(
         dna_db_connect,
         p2p_db_connect,
         script_data,
@@ -293,12 +828,18 @@ def thread_sub(
         thread_id,
         zoe_data,
         apwx,
+        shard_bounds,
+        changed_keys,
+        apwx.args.SQL_FORMAT_YN == "Y",
     )
+    if shard_stats is not None:
+        shard_stats[thread_id] = stats
 
     # Close connections
     if dna_db_connect:
         dna_db_connect.close()
 
+    stop_profiling(profiler, script_data.profile_dir, f"thread_{thread_id}")
     print(f"Finished thread: {thread_id}")
 
 
@@ -310,22 +851,54 @@ def process_zoe_records(
     thread_id: int,
     zoe_data: list,
     apwx: Apwx,
-):
+    shard_bounds: tuple = (0, SHARD_BUCKETS - 1),
+    changed_keys: Optional[Dict] = None,
+    sql_format: bool = False,
+) -> Dict:
     """Process ZOE records from database queries"""
     # script_data = initialize(apwx)
 
     # Get P2P customer data first
     p2p_cust = {}
-    if p2p_dbh:
+    error_ct = 0
+    staged = False
+    if p2p_dbh and apwx.args.P2P_STAGE_YN == "Y":
+        # Detail queries outer-join the staged rows, so nothing is kept here
+        try:
+            stage_p2p_customers(dna_dbh, p2p_dbh, script_data.config)
+            staged = True
+        except Exception as e:
+            # Rows left unstaged come back with NULL overrides, which
+            # build_detail_record and splice_p2p_overrides fill from p2p_cust
+            print(
+                f"[THREAD {thread_id}] Error staging P2P customer data: {e}; "
+                "using in-memory P2P lookup"
+            )
+    if p2p_dbh and not staged:
         try:
             p2p_records = execute_sql_select(p2p_dbh, script_data.config["p2pCustOrg"])
             for record in p2p_records:
                 p2p_cust[record.get("persnbr")] = record
         except Exception as e:
             print(f"Error fetching P2P customer data: {e}")
-
-    render_values = {"max_thread": max_thread, "thread_id": thread_id}
+        if not p2p_cust and apwx.args.P2P_STAGE_YN == "Y":
+            # Neither staged nor in-memory overrides are available
+            print(f"[THREAD {thread_id}] No P2P customer data for overrides")
+            error_ct += 1
+    profile_snapshot(script_data.profile_dir, f"after_p2p_load_thread_{thread_id}")
+
+    render_values = {
+        "max_thread": max_thread,
+        "thread_id": thread_id,
+        "max_bucket": SHARD_BUCKETS - 1,
+        "bucket_lo": shard_bounds[0],
+        "bucket_hi": shard_bounds[1],
+    }
     max_rows = 1000
+    row_ct = 0
+    detail_ct = 0
+    detail_seconds = 0.0
+    key_type = None
 
     # List of config keys for each SQL query
     query_keys = [
@@ -339,6 +912,7 @@ def process_zoe_records(
     ]
 
     for key in query_keys:
+        query_start = time.monotonic()
         try:
             # print("key-----: ", key)
             # sql = script_data.config["sql_qq"] + "\n" + script_data.config[key]
@@ -351,31 +925,61 @@ def process_zoe_records(
             cur = dbh.cursor()
 
             try:
-                if key == "p2pCustOrg":
-                    cur.execute(sql)
-                else:
-                    if key == "org":
-                        sql = script_data.config[key]
-                    else:
-                        sql = (
-                            script_data.config["sql_qq"]
-                            + "\n"
-                            + script_data.config[key]
-                        )
-                    # print("SQL_______:", sql)
-                    cur.execute(sql, render_values)
-
-                while True:
-                    records = cur.fetchmany(max_rows)
-                    if not records:
-                        break
+                bind_sets = [None]
+                if key != "p2pCustOrg":
+                    sql = build_detail_sql(
+                        script_data.config,
+                        key,
+                        changed_keys is not None,
+                        sql_format,
+                        apwx.args.P2P_STAGE_YN == "Y",
+                    )
+                    bind_sets = [render_values]
+
+                    if changed_keys is not None:
+                        # INCR only: batches of changed keys joined in as a collection
+                        if key_type is None:
+                            key_type = dbh.gettype("SYS.ODCINUMBERLIST")
+                        keys = changed_keys["org" if key == "org" else "pers"]
+                        bind_sets = [
+                            dict(
+                                render_values,
+                                chg_keys=key_type.newobject(
+                                    keys[i : i + CHANGED_KEY_BATCH]
+                                ),
+                            )
+                            for i in range(0, len(keys), CHANGED_KEY_BATCH)
+                        ]
 
-                    for record in records:
-                        record_list = list(record)
-                        is_org = key in ["cardOwnPersOrg", "org"]
-                        line = build_detail_record(record_list, p2p_cust, is_org)
-                        if line:
-                            zoe_data.append(line)
+                for bind_set in bind_sets:
+                    if bind_set is None:
+                        cur.execute(sql)
+                    else:
+                        # print("SQL_______:", sql)
+                        cur.execute(sql, get_bind_values(sql, bind_set))
+
+                    while True:
+                        records = cur.fetchmany(max_rows)
+                        if not records:
+                            break
+
+                        is_org = key in ORG_QUERY_KEYS
+                        for record in records:
+                            if sql_format and key != "p2pCustOrg":
+                                line = record[0] or ""
+                                if not is_org and record[1] in p2p_cust:
+                                    line = splice_p2p_overrides(
+                                        line, p2p_cust[record[1]]
+                                    )
+                            else:
+                                line = build_detail_record(
+                                    list(record), p2p_cust, is_org
+                                )
+                            if line:
+                                zoe_data.append(line)
+                                row_ct += 1
+                                if key != "p2pCustOrg":
+                                    detail_ct += 1
 
                 print(f"[THREAD {thread_id}] Processed records from '{key}'.")
 
@@ -384,6 +988,190 @@ def process_zoe_records(
 
         except Exception as e:
             print(f"[THREAD {thread_id}] Error processing query '{key}': {e}")
+            error_ct += 1
+
+        # Shard cost covers only the sharded detail queries; the P2P load and
+        # the unsharded p2pCustOrg query cost every shard the same
+        if key != "p2pCustOrg":
+            detail_seconds += time.monotonic() - query_start
+
+    return {
+        "rows": row_ct,
+        "seconds": round(detail_seconds, 3),
+        "detailRows": detail_ct,
+        "errors": error_ct,
+    }
+
+
+def build_detail_sql(
+    config: Dict,
+    key: str,
+    incremental: bool = False,
+    sql_format: bool = False,
+    p2p_stage: bool = False,
+) -> str:
+    """Assemble a detail query, adding optional joins only when they are used"""
+    if key == "org":
+        sql = config[key]
+    else:
+        sql = config["sql_qq"] + "\n" + config[key]
+
+    # Person queries get the staged P2P columns only when staging is on;
+    # SQL formatting without staging needs the same columns as NULLs
+    p2p_stage_cols = ""
+    p2p_stage_join = ""
+    if p2p_stage:
+        p2p_stage_cols = config["p2pStageCols"]
+        p2p_stage_join = config["p2pStageJoin"]
+    elif sql_format:
+        p2p_stage_cols = config["p2pNullCols"]
+    sql = sql.replace("{p2p_stage_cols}", p2p_stage_cols)
+    sql = sql.replace("{p2p_stage_join}", p2p_stage_join)
+
+    chg_keys_join = ""
+    if incremental:
+        chg_keys_join = config["chgKeysJoin"].replace(
+            "{key_col}", config["detailKeyColumns"][key]
+        )
+    sql = sql.replace("{chg_keys_join}", chg_keys_join)
+
+    if sql_format:
+        # Rows come back as one pipe-delimited line plus persnbr
+        fmt_key = "formatOrg" if key in ORG_QUERY_KEYS else "formatPers"
+        sql = config[fmt_key].replace("{detail_sql}", sql)
+    return sql
+
+
+def stage_p2p_customers(dna_dbh: DbConnection, p2p_dbh, config: Dict) -> int:
+    """Bulk-load P2P customer rows into the DNA session's staging table"""
+    staged = 0
+    rejected = 0
+
+    with p2p_dbh.cursor() as p2p_cur, dna_dbh.cursor() as dna_cur:
+        p2p_cur.execute(config["p2pCustOrg"])
+        cols = [desc[0] for desc in p2p_cur.description]
+        col_idx = [cols.index(col) for col in ("persnbr",) + P2P_OVERRIDE_COLS]
+
+        # Streamed in batches so the P2P table is never held in memory
+        while True:
+            rows = p2p_cur.fetchmany(P2P_STAGE_BATCH)
+            if not rows:
+                break
+            dna_cur.executemany(
+                config["p2pStageInsert"],
+                [tuple(row[i] for i in col_idx) for row in rows],
+                batcherrors=True,
+            )
+            rejected += len(dna_cur.getbatcherrors())
+            staged += len(rows)
+
+    dna_dbh.commit()
+    print(f"Staged {staged - rejected} P2P customers ({rejected} rejected)")
+    return staged - rejected
+
+
+def check_p2p_stage(dbh: DbConnection):
+    """Check the P2P staging table from zoe_p2p_stage.sql has been deployed"""
+    with dbh.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*) FROM user_tables WHERE table_name = 'ZOE_P2P_CUST'"
+        )
+        if cur.fetchone()[0] == 0:
+            raise ValueError(
+                "P2P_STAGE_YN=Y requires table ZOE_P2P_CUST; "
+                "deploy zoe_p2p_stage.sql first"
+            )
+
+
+def get_bind_values(sql: str, values: Dict) -> Dict:
+    """Return only the bind values whose placeholders appear in the SQL"""
+    return {k: v for k, v in values.items() if f"%({k})s" in sql}
+
+
+def get_shard_history(history_path: str) -> Optional[Dict]:
+    """Load per-shard row counts and durations from the previous run"""
+    try:
+        with open(history_path, "r") as f:
+            return yaml.safe_load(f)
+    except FileNotFoundError:
+        print(f"No shard history at {history_path}, using equal shards")
+    except Exception as e:
+        print(f"Error reading shard history {history_path}: {e}")
+    return None
+
+
+def save_shard_history(history_path: str, shard_bounds: List, shard_stats: Dict):
+    """Save per-shard bucket ranges, row counts and durations for the next run"""
+    shards = []
+    for thread_id, (bucket_lo, bucket_hi) in enumerate(shard_bounds):
+        stats = shard_stats.get(thread_id, {})
+        shards.append(
+            {
+                "bucketLo": bucket_lo,
+                "bucketHi": bucket_hi,
+                "rows": stats.get("detailRows", 0),
+                "seconds": stats.get("seconds", 0),
+            }
+        )
+        print(
+            f"Shard {thread_id} buckets {bucket_lo}-{bucket_hi}: "
+            f"{stats.get('detailRows', 0)} detail rows in {stats.get('seconds', 0)}s"
+            f", {stats.get('errors', 0)} failed queries"
+        )
+
+    # A missing or failed shard would skew the next run's boundaries; one
+    # whose queries errored finishes fast and looks cheap
+    if len(shard_stats) < len(shard_bounds):
+        print("Not all shards reported, shard history not updated")
+        return
+    if any(stats.get("errors") for stats in shard_stats.values()):
+        print("Some shards had failed queries, shard history not updated")
+        return
+
+    try:
+        with open(history_path, "w") as f:
+            yaml.safe_dump({"shardBuckets": SHARD_BUCKETS, "shards": shards}, f)
+    except Exception as e:
+        print(f"Error writing shard history {history_path}: {e}")
+
+
+def compute_shard_bounds(history: Optional[Dict], shards: int, buckets: int) -> List:
+    """Choose ORA_HASH bucket ranges so each shard takes roughly equal time"""
+    shards = max(min(shards, buckets), 1)
+
+    # Spread each previous shard's time evenly over its buckets; shards with
+    # no recorded time fall back to row counts, then to one unit per bucket
+    cost = [1.0] * buckets
+    if history and history.get("shardBuckets") == buckets:
+        hist_shards = history.get("shards") or []
+        use_time = all(h.get("seconds") for h in hist_shards)
+        for h in hist_shards:
+            lo, hi = int(h["bucketLo"]), int(h["bucketHi"])
+            weight = h.get("seconds") if use_time else h.get("rows")
+            width = hi - lo + 1
+            for b in range(max(lo, 0), min(hi, buckets - 1) + 1):
+                cost[b] = max(float(weight or 0), 1.0) / width
+
+    # Re-aim at the remaining cost after every cut, so one expensive bucket
+    # does not push every later cut onto a single bucket
+    remaining = sum(cost)
+    bounds = []
+    bucket_lo = 0
+    running = 0.0
+    for b in range(buckets):
+        if len(bounds) == shards - 1:
+            break
+        running += cost[b]
+        shards_left = shards - len(bounds)
+        target = remaining / shards_left
+        if running >= target or buckets - b - 1 == shards_left - 1:
+            bounds.append((bucket_lo, b))
+            bucket_lo = b + 1
+            remaining -= running
+            running = 0.0
+    bounds.append((bucket_lo, buckets - 1))
+
+    return bounds
 
 
 #
@@ -455,8 +1243,19 @@ def build_detail_record(record_ary: List, p2p_cust: Dict, is_org: bool = False)
     persnbr = record_ary[1] if len(record_ary) > 1 else None
     line_ary = record_ary[0:2]
 
-    if not is_org and persnbr in p2p_cust and p2p_cust[persnbr].get("CXCCustomerID"):
-        line_ary.append(p2p_cust[persnbr]["CXCCustomerID"])
+    # P2P overrides come from the staged outer join (index 50 to 52) when
+    # present, otherwise from the in-memory P2P customer table
+    cxc_id = reg_email = reg_phone = None
+    if not is_org:
+        if len(record_ary) > 52 and any(record_ary[50:53]):
+            cxc_id, reg_email, reg_phone = record_ary[50:53]
+        elif persnbr in p2p_cust:
+            cxc_id = p2p_cust[persnbr].get("CXCCustomerID")
+            reg_email = p2p_cust[persnbr].get("registeredEmail")
+            reg_phone = p2p_cust[persnbr].get("registeredPhone")
+
+    if cxc_id:
+        line_ary.append(cxc_id)
     else:
         line_ary.append(persnbr)
 
@@ -465,8 +1264,8 @@ def build_detail_record(record_ary: List, p2p_cust: Dict, is_org: bool = False)
     else:
         line_ary.extend([""] * (13 - len(line_ary)))
 
-    if not is_org and persnbr in p2p_cust and p2p_cust[persnbr].get("registeredEmail"):
-        line_ary.append(p2p_cust[persnbr]["registeredEmail"])
+    if reg_email:
+        line_ary.append(reg_email)
         line_ary.append(1)
     else:
         line_ary.append(record_ary[13] if len(record_ary) > 13 else "")
@@ -490,8 +1289,8 @@ def build_detail_record(record_ary: List, p2p_cust: Dict, is_org: bool = False)
         line_ary.extend([""] * 6)
 
     # registeredPhone and boolean
-    if not is_org and persnbr in p2p_cust and p2p_cust[persnbr].get("registeredPhone"):
-        line_ary.append(p2p_cust[persnbr]["registeredPhone"])
+    if reg_phone:
+        line_ary.append(reg_phone)
         line_ary.append(1)
     else:
         line_ary.append(record_ary[23] if len(record_ary) > 23 else "")
@@ -516,6 +1315,72 @@ def build_detail_record(record_ary: List, p2p_cust: Dict, is_org: bool = False)
     return "|".join(str(val) if val is not None else "" for val in line_ary)
 
 
+def splice_p2p_overrides(line: str, p2p: Dict) -> str:
+    """Apply P2P customer ID, email and phone to a SQL formatted record"""
+    line_ary = line.split("|")
+    if p2p.get("CXCCustomerID"):
+        line_ary[2] = str(p2p["CXCCustomerID"])
+    if p2p.get("registeredEmail"):
+        line_ary[14:16] = [str(p2p["registeredEmail"]), "1"]
+    if p2p.get("registeredPhone"):
+        line_ary[30:32] = [str(p2p["registeredPhone"]), "1"]
+    return "|".join(line_ary)
+
+
+def check_format_parity(apwx: Apwx, script_data, max_diffs: int = 10) -> bool:
+    """Compare SQL formatted records with build_detail_record for one bucket"""
+    # Everything the queries depend on must be there, or both sides could
+    # fail the same way and still match
+    if apwx.args.P2P_STAGE_YN == "Y":
+        check_p2p_stage(script_data.dbh)
+    p2p_dbh = p2p_db_connect_func(
+        {"p2pServer": apwx.args.P2P_SERVER, "p2pSchema": apwx.args.P2P_SCHEMA}
+    )
+    if p2p_dbh is None:
+        print("Format check: P2P database is not available")
+        return False
+
+    results = {}
+    passed = True
+    for sql_format in (False, True):
+        zoe_data = []
+        stats = process_zoe_records(
+            script_data.dbh,
+            p2p_dbh,
+            script_data,
+            1,
+            0,
+            zoe_data,
+            apwx,
+            (0, 0),
+            None,
+            sql_format,
+        )
+        results[sql_format] = Counter(zoe_data)
+
+        label = "SQL" if sql_format else "Python"
+        if stats["errors"]:
+            print(f"Format check: {stats['errors']} {label} queries failed")
+            passed = False
+        if not stats["detailRows"]:
+            print(f"Format check: {label} side returned no detail records")
+            passed = False
+
+    # Row order differs between executions, so compare as multisets
+    python_only = results[False] - results[True]
+    sql_only = results[True] - results[False]
+    print(
+        f"Format check: {sum(results[False].values())} Python records, "
+        f"{sum(results[True].values())} SQL records, "
+        f"{sum(python_only.values())} Python-only, {sum(sql_only.values())} SQL-only"
+    )
+    for label, diffs in (("python", python_only), ("sql", sql_only)):
+        for line in list(diffs)[:max_diffs]:
+            print(f"  {label}: {line}")
+
+    return passed and not python_only and not sql_only
+
+
 def parse_id(id_record_str: str, is_org: bool = False) -> List[str]:
     """Parse ID record string into components"""
     id_ary = []
@@ -682,6 +1547,332 @@ def get_zoe_file_hash(file_path: str) -> tuple:
     return hash_zoe, acct_hash
 
 
+def get_record_digest(record_data: str) -> bytes:
+    """Digest of a detail record without its 5 metadata fields"""
+    return hashlib.blake2b(
+        record_data.encode("utf-8", "surrogateescape"), digest_size=16
+    ).digest()
+
+
+def get_zoe_file_digests(file_path: str) -> Dict:
+    """Get key to record digest map of a ZOE file"""
+    digest_zoe = {}
+
+    try:
+        with open(
+            file_path, "r", encoding="utf-8", errors="surrogateescape", newline="\n"
+        ) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("6|"):
+                    parts = line.split("|", 5)
+                    if len(parts) > 5 and "|" in parts[5]:
+                        # Same key and record data as split_zoe_record
+                        digest_zoe[get_record_key(parts[5])] = get_record_digest(
+                            parts[5]
+                        )
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
+
+    return digest_zoe
+
+
+def get_db_sysdate(dbh) -> datetime:
+    """Get the DNA database clock, used as the incremental watermark"""
+    with dbh.cursor() as cur:
+        cur.execute("SELECT SYSDATE FROM dual")
+        return cur.fetchone()[0]
+
+
+def get_changed_keys(script_data, since: datetime) -> Dict:
+    """Query DNA for persnbrs and orgnbrs changed since the watermark"""
+    changed_keys = {}
+    for key, config_key in (("pers", "changedPers"), ("org", "changedOrg")):
+        with script_data.dbh.cursor() as cur:
+            cur.execute(script_data.config[config_key], {"since": since})
+            changed_keys[key] = [row[0] for row in cur.fetchall()]
+        print(f"Found {len(changed_keys[key])} changed {key} keys since {since}")
+    return changed_keys
+
+
+def get_p2p_digests(apwx: Apwx, config: Dict) -> Dict:
+    """Get persnbr to digest map of each P2P customer's override values"""
+    p2p_dbh = p2p_db_connect_func(
+        {"p2pServer": apwx.args.P2P_SERVER, "p2pSchema": apwx.args.P2P_SCHEMA}
+    )
+    if p2p_dbh is None:
+        raise ValueError("INCR mode requires the P2P database to detect P2P changes")
+
+    digests = {}
+    try:
+        # Errors are raised, not swallowed, so an outage never reads as
+        # every P2P customer being removed
+        with p2p_dbh.cursor() as cur:
+            cur.execute(config["p2pCustOrg"])
+            cols = [desc[0] for desc in cur.description]
+            col_idx = [cols.index(col) for col in ("persnbr",) + P2P_OVERRIDE_COLS]
+            while True:
+                rows = cur.fetchmany(P2P_STAGE_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    values = [row[i] for i in col_idx]
+                    if values[0] is None or not str(values[0]).isdigit():
+                        continue
+                    digests[str(int(values[0]))] = get_record_digest(
+                        "|".join("" if v is None else str(v) for v in values[1:])
+                    )
+    finally:
+        p2p_dbh.close()
+
+    return digests
+
+
+def get_delta_state_path(apwx: Apwx) -> str:
+    """INCR state file, defaulting to <output>.state.json"""
+    return apwx.args.DELTA_STATE_FILE or os.path.join(
+        apwx.args.OUTPUT_FILE_PATH, apwx.args.OUTPUT_FILE_NAME + ".state.json"
+    )
+
+
+def get_delta_state(state_path: str, old_zoe_file: str = None) -> Optional[Dict]:
+    """Load the incremental watermark and key/digest state"""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        # Stored as plain JSON text; digests are hex and compared as bytes
+        return {
+            "watermark": datetime.fromisoformat(state["watermark"]),
+            "digests": {
+                key: bytes.fromhex(digest)
+                for key, digest in state["digests"].items()
+            },
+            "p2p": {
+                key: bytes.fromhex(digest)
+                for key, digest in state.get("p2p", {}).items()
+            },
+        }
+    except FileNotFoundError:
+        print(f"No delta state at {state_path}")
+
+    if not old_zoe_file or not os.path.exists(old_zoe_file):
+        return None
+
+    # Seed from the previous file; the watermark is pushed back a day to
+    # cover changes made while that file was being extracted. With no P2P
+    # digests yet, every current P2P customer is re-extracted once
+    print(f"Seeding delta state from {old_zoe_file}")
+    file_epoch = os.stat(old_zoe_file).st_mtime
+    return {
+        "watermark": datetime.fromtimestamp(file_epoch) - timedelta(days=1),
+        "digests": get_zoe_file_digests(old_zoe_file),
+        "p2p": {},
+    }
+
+
+def save_delta_state(state_path: str, state: Dict):
+    """Save the incremental watermark and key/digest state"""
+    # Write then rename so a failed run never leaves a partial state file
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "watermark": state["watermark"].isoformat(),
+                "digests": {
+                    key: digest.hex() for key, digest in state["digests"].items()
+                },
+                "p2p": {key: digest.hex() for key, digest in state["p2p"].items()},
+            },
+            f,
+            separators=(",", ":"),
+        )
+    os.replace(tmp_path, state_path)
+    print(f"Saved delta state ({len(state['digests'])} keys) to {state_path}")
+
+
+def verify_zoe_file(file_path: str, workers: int = 1) -> List[str]:
+    """Verify trailer counts, account hash and column counts of a ZOE file"""
+    errors = []
+
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [f"File is empty: {file_path}"]
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # CDE line, header and trailer are read directly; only the
+            # detail lines between them are handed to the workers
+            cde_end = mm.find(b"\n")
+            header_end = mm.find(b"\n", cde_end + 1)
+            if cde_end < 0 or header_end < 0:
+                return [f"File is missing CDE or header record: {file_path}"]
+
+            trailer_end = len(mm)
+            while trailer_end > 0 and mm[trailer_end - 1 : trailer_end] in (
+                b"\n",
+                b"\r",
+            ):
+                trailer_end -= 1
+            trailer_start = mm.rfind(b"\n", 0, trailer_end) + 1
+
+            cde_line = mm[:cde_end].decode("latin-1").rstrip("\r")
+            header_line = mm[cde_end + 1 : header_end].decode("latin-1").rstrip("\r")
+            trailer_line = mm[trailer_start:trailer_end].decode("latin-1")
+            chunk_ct = max(
+                workers, (trailer_start - header_end) // VERIFY_CHUNK_BYTES + 1
+            )
+            chunks = get_chunk_bounds(mm, header_end + 1, trailer_start, chunk_ct)
+
+    if cde_line != build_cde_record():
+        errors.append("CDE record does not match build_cde_record()")
+    expected_cols = len(build_cde_record().split("|"))
+
+    header_ary = header_line.split("|")
+    trailer_ary = trailer_line.split("|")
+    if header_ary[0] != "1":
+        errors.append(f"Line 2 is not a header record: {header_line[:40]}")
+    if trailer_ary[0] != "9":
+        errors.append(f"Last line is not a trailer record: {trailer_line[:40]}")
+        return errors
+    if len(header_ary) > 1 and header_ary[1:4] != trailer_ary[1:4]:
+        errors.append(
+            f"Header {header_ary[1:4]} does not match trailer {trailer_ary[1:4]}"
+        )
+
+    if workers > 1 and len(chunks) > 1:
+        with Pool(min(workers, len(chunks))) as pool:
+            results = pool.starmap(
+                verify_zoe_chunk,
+                [(file_path, start, end, expected_cols) for start, end in chunks],
+            )
+    else:
+        results = [
+            verify_zoe_chunk(file_path, start, end, expected_cols)
+            for start, end in chunks
+        ]
+
+    totals = {"detail": 0, "A": 0, "C": 0, "D": 0, "acctHash": 0}
+    bad_labels = {
+        "badCols": f"detail records do not have {expected_cols} columns",
+        "badActions": "detail records have an action other than A, C or D",
+        "badLines": "lines between header and trailer are not detail records",
+        "blankLines": "blank lines between header and trailer",
+    }
+    for k in bad_labels:
+        totals[k] = 0
+    bad_offsets = {}
+    for result in results:
+        for k in totals:
+            totals[k] += result[k]
+        # Chunks are in file order, so the first offset found is the lowest
+        for k in bad_labels:
+            if k not in bad_offsets and result[k + "Offset"] is not None:
+                bad_offsets[k] = result[k + "Offset"]
+
+    for k, label in bad_labels.items():
+        if totals[k]:
+            errors.append(
+                f"{totals[k]} {label} (first at byte offset {bad_offsets[k]})"
+            )
+
+    trailer_vals = dict(
+        pair.split(":", 1) for pair in trailer_ary[4:] if ":" in pair
+    )
+    checks = [
+        ("CDE0133", "record count", totals["detail"] + 2),  # +2 for header/trailer
+        ("CDE0111", "added count", totals["A"]),
+        ("CDE0120", "changed count", totals["C"]),
+        ("CDE0121", "deleted count", totals["D"]),
+        ("CDE0110", "account hash", totals["acctHash"]),
+    ]
+    for cde, label, actual in checks:
+        expected = trailer_vals.get(cde)
+        if expected is None:
+            errors.append(f"Trailer is missing {cde} ({label})")
+        elif expected != str(actual):
+            errors.append(f"{label} {cde}: trailer {expected}, file {actual}")
+
+    print(
+        f"Verified {totals['detail']} detail records "
+        f"(A={totals['A']} C={totals['C']} D={totals['D']} "
+        f"acctHash={totals['acctHash']})"
+    )
+    return errors
+
+
+def get_chunk_bounds(mm, start: int, end: int, chunks: int) -> List[tuple]:
+    """Split a byte range into roughly equal chunks ending on line boundaries"""
+    if end <= start:
+        return []
+
+    size = max((end - start) // max(chunks, 1), 1)
+    bounds = []
+    pos = start
+    while pos < end:
+        split = mm.find(b"\n", min(pos + size, end) - 1, end)
+        split = end if split < 0 else split + 1
+        bounds.append((pos, split))
+        pos = split
+    return bounds
+
+
+def verify_zoe_chunk(file_path: str, start: int, end: int, expected_cols: int) -> Dict:
+    """Recompute detail counters for one byte range of a ZOE file"""
+    result = {
+        "detail": 0,
+        "A": 0,
+        "C": 0,
+        "D": 0,
+        "acctHash": 0,
+    }
+    # Every line that is not a well-formed detail record is counted, with
+    # the byte offset of the first one
+    for k in ("badCols", "badActions", "badLines", "blankLines"):
+        result[k] = 0
+        result[k + "Offset"] = None
+    sep_ct = expected_cols - 1
+
+    def flag(k: str, line_offset: int):
+        result[k] += 1
+        if result[k + "Offset"] is None:
+            result[k + "Offset"] = line_offset
+
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = mm[start:end]
+            lines = data.split(b"\n")
+            if data.endswith(b"\n"):
+                lines.pop()  # Split artifact after the chunk's last newline
+            offset = start
+            for line in lines:
+                line_offset = offset
+                offset += len(line) + 1
+                if not line.rstrip(b"\r"):
+                    flag("blankLines", line_offset)
+                    continue
+                if not line.startswith(b"6|"):
+                    flag("badLines", line_offset)
+                    continue
+
+                result["detail"] += 1
+                action = line[2:4]
+                if action in (b"A|", b"C|", b"D|"):
+                    result[action[:1].decode("latin-1")] += 1
+                else:
+                    flag("badActions", line_offset)
+
+                if line.rstrip(b"\r").count(b"|") != sep_ct:
+                    flag("badCols", line_offset)
+
+                # Account number is the 4th data field after the 5 metadata fields
+                parts = line.split(b"|", 9)
+                if len(parts) > 8 and parts[8].isdigit():
+                    result["acctHash"] += int(parts[8])
+
+    return result
+
+
 def p2p_db_connect_func(args: dict, state: dict = None):
     """Connects to a SQL Server P2P database"""
     if state is None:
@@ -809,7 +2000,81 @@ def initialize(apwx: Apwx) -> ScriptData:
     dbh = apwx.db_connect(autocommit=False)
     # print("DBH: ", dbh)
     config = get_config(apwx)
-    return ScriptData(apwx=apwx, dbh=dbh, config=config)
+    return ScriptData(
+        apwx=apwx, dbh=dbh, config=config, profile_dir=get_profile_dir(apwx)
+    )
+
+
+def get_profile_dir(apwx: Apwx) -> Optional[str]:
+    """Profile output directory next to the output file, when DEBUG_YN is Y"""
+    if apwx.args.DEBUG_YN != "Y":
+        return None
+    return os.path.join(
+        apwx.args.OUTPUT_FILE_PATH, apwx.args.OUTPUT_FILE_NAME + ".profile"
+    )
+
+
+def start_profiling(
+    profile_dir: Optional[str], worker: bool = False
+) -> Optional[cProfile.Profile]:
+    """Start cProfile for the calling thread and tracemalloc for the process"""
+    if profile_dir is None:
+        return None
+
+    os.makedirs(profile_dir, exist_ok=True)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    # From 3.12 cProfile uses process-wide sys.monitoring: the main profiler
+    # already sees every thread and a second one cannot be enabled
+    if worker and sys.version_info >= (3, 12):
+        return None
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Profiling is diagnostic only and must never stop an extraction
+        print(f"CPU profiling not started: {e}")
+        return None
+    return profiler
+
+
+def stop_profiling(
+    profiler: Optional[cProfile.Profile], profile_dir: Optional[str], name: str
+):
+    """Write the calling thread's CPU profile and a top-N cumulative report"""
+    if profiler is None or profile_dir is None:
+        return
+
+    profiler.disable()
+    profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+    with open(os.path.join(profile_dir, f"{name}.txt"), "w") as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    print(f"Wrote CPU profile {name} to {profile_dir}")
+
+
+def profile_snapshot(profile_dir: Optional[str], phase: str):
+    """Save a tracemalloc snapshot and top-N allocation report for a phase"""
+    if profile_dir is None or not tracemalloc.is_tracing():
+        return
+
+    snapshot = tracemalloc.take_snapshot()
+    snapshot.dump(os.path.join(profile_dir, f"{phase}.snapshot"))
+    current, peak = tracemalloc.get_traced_memory()
+
+    with open(os.path.join(profile_dir, f"{phase}.mem.txt"), "w") as f:
+        f.write(f"Phase: {phase}\n")
+        f.write(f"Current: {current / 1048576:.1f} MiB\n")
+        f.write(f"Peak: {peak / 1048576:.1f} MiB\n\n")
+        f.write(f"Top {PROFILE_TOP_N} allocations by line\n")
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_N]:
+            f.write(f"{stat}\n")
+    print(
+        f"Memory at {phase}: {current / 1048576:.1f} MiB "
+        f"(peak {peak / 1048576:.1f} MiB)"
+    )
 
 
 def get_config(apwx: Apwx) -> Any:
@@ -849,6 +2114,31 @@ def parse_args(apwx: Apwx) -> Apwx:
     parser.add_arg(AppWorxEnum.OLD_ZOE_FILE, type=str, required=False)
     parser.add_arg(AppWorxEnum.NEW_ZOE_FILE, type=str, required=False)
 
+    # VERIFY mode checks this file, or the output file when not given
+    parser.add_arg(AppWorxEnum.VERIFY_ZOE_FILE, type=str, required=False)
+
+    # NEW_DELTA mode writes the UPDT file under this name in OUTPUT_FILE_PATH
+    parser.add_arg(AppWorxEnum.UPDT_FILE_NAME, type=str, required=False)
+
+    # Per-shard timing history, defaults to <output>.shards.yaml
+    parser.add_arg(AppWorxEnum.SHARD_HISTORY_FILE, type=str, required=False)
+
+    # INCR mode watermark and key/digest state, defaults to <output>.state.json
+    parser.add_arg(AppWorxEnum.DELTA_STATE_FILE, type=str, required=False)
+    parser.add_arg(
+        AppWorxEnum.P2P_STAGE_YN, choices=["Y", "N"], default="N", required=False
+    )
+    parser.add_arg(
+        AppWorxEnum.SQL_FORMAT_YN, choices=["Y", "N"], default="N", required=False
+    )
+
+    # Multi-host runs: SHARD_RANGE is "lo-hi" (or one shard) of SHARD_TOTAL
+    parser.add_arg(AppWorxEnum.SHARD_TOTAL, type=str, required=False)
+    parser.add_arg(AppWorxEnum.SHARD_RANGE, type=str, required=False)
+    # Identifies one multi-host run, e.g. the run date; FINALIZE only merges
+    # partials written with the same RUN_ID
+    parser.add_arg(AppWorxEnum.RUN_ID, type=str, required=False)
+
     apwx.parse_args()
     return apwx
 
@@ -858,7 +2148,13 @@ if __name__ == "__main__":
     print(f"Job started at {datetime.now()}")
 
     JobTime().print_start()
-    run(parse_args(get_apwx()), time.time())
+    apwx = parse_args(get_apwx())
+    profile_dir = get_profile_dir(apwx)
+    profiler = start_profiling(profile_dir)
+    try:
+        run(apwx, time.time())
+    finally:
+        stop_profiling(profiler, profile_dir, "main")
     JobTime().print_end()
 
     print(f"Job finished at {datetime.now()}")
@@ -0,0 +1,9 @@
+-- One-time deployment for P2P_STAGE_YN=Y: P2P customer staging table.
+-- Run once in the DNA schema the ZOE job connects to; the job only checks
+-- that it exists and never issues DDL itself.
+CREATE GLOBAL TEMPORARY TABLE zoe_p2p_cust (
+    persnbr NUMBER PRIMARY KEY,
+    cxccustomerid VARCHAR2(100),
+    registeredemail VARCHAR2(320),
+    registeredphone VARCHAR2(50)
+) ON COMMIT PRESERVE ROWS;
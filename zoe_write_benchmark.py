@@ -0,0 +1,107 @@
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from zoe_converter import ZoeFileWriter, split_zoe_record
+
+
+def build_records(record_ct: int) -> list:
+    """Build synthetic 57-field detail records shaped like build_detail_record output"""
+    records = []
+    for i in range(record_ct):
+        fields = [f"field{n}" for n in range(57)]
+        fields[0] = ""
+        fields[1] = str(1000000 + i)
+        fields[3] = str(5000000 + i)
+        fields[19] = "LAST,FIRST\tM.,"  # stray tab, sanitized on write
+        fields[56] = "ACT"
+        records.append("|".join(fields))
+    return records
+
+
+def write_text_per_record(records: list, path: str, test_yn: str = "N"):
+    """Previous NEW mode write loop: text mode, regex and split/join per record"""
+    seq_nbr = 0
+    acct_hash = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            record = str(record).strip()
+            record = re.sub(r"\t+", " ", record)  # Replace tabs with spaces
+
+            line_ary = record.split("|")
+            if len(line_ary) > 3:
+                acct_hash += int(line_ary[3]) if line_ary[3].isdigit() else 0
+
+            # Remove the last element (account status) from line_ary
+            acct_stat = line_ary.pop() if line_ary else ""
+
+            detail_first5 = "|".join(
+                ["6", "A", "03" if test_yn == "Y" else "01", "FTF", str(seq_nbr + 1)]
+            )
+            seq_nbr += 1
+
+            line = "|".join([detail_first5] + line_ary[:56])
+            f.write(line + "\n")
+    return acct_hash
+
+
+def write_bytes_batched(records: list, path: str, test_yn: str = "N"):
+    """Current NEW mode write loop through ZoeFileWriter"""
+    env = "03" if test_yn == "Y" else "01"
+    seq_nbr = 0
+    acct_hash = 0
+    with ZoeFileWriter(path) as f:
+        for record in records:
+            record_data = split_zoe_record(record)[1]
+
+            line_ary = record_data.split("|", 4)
+            if len(line_ary) > 3 and line_ary[3].isdigit():
+                acct_hash += int(line_ary[3])
+
+            seq_nbr += 1
+            f.write(f"6|A|{env}|FTF|{seq_nbr}|{record_data}")
+    return acct_hash
+
+
+def time_writer(writer, records: list, path: str, rounds: int) -> float:
+    """Best per-record time in microseconds over several rounds"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        writer(records, path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(records) * 1000000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ZOE detail write paths")
+    parser.add_argument("--records", type=int, default=500000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--dir", default=None, help="Directory for scratch files")
+    args = parser.parse_args()
+
+    records = build_records(args.records)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        before_path = os.path.join(tmp_dir, "before.FTF")
+        after_path = os.path.join(tmp_dir, "after.FTF")
+
+        before_us = time_writer(
+            write_text_per_record, records, before_path, args.rounds
+        )
+        after_us = time_writer(write_bytes_batched, records, after_path, args.rounds)
+
+        with open(before_path, "rb") as f_before, open(after_path, "rb") as f_after:
+            identical = f_before.read() == f_after.read()
+
+    print(f"Records: {args.records}")
+    print(f"Text per-record write: {before_us:.3f} us/record")
+    print(f"Bytes batched write:   {after_us:.3f} us/record")
+    print(f"Speedup: {before_us / after_us:.2f}x")
+    print(f"Output identical: {identical}")
+
+
+if __name__ == "__main__":
+    main()